@@ -7,7 +7,8 @@ import transformers
 from transformers import AutoTokenizer
 
 import misc
-from utils import data_utils, eval_utils, gptq_utils, hadamard_utils, model_utils, quant_utils, rotation_utils
+from utils import data_utils, eval_utils, gptq_utils, hadamard_utils, model_utils, quant_utils, rotation_utils, \
+    torchao_quant
 from utils.householder_utils import get_householder_indices
 from utils.rotation_utils import get_orthogonal_matrix
 
@@ -120,6 +121,12 @@ def main():
             qlayers[name].quantizer.configure(bits=layer_input_bits, groupsize=layer_groupsize,
                                               sym=layer_a_sym, clip_ratio=layer_a_clip)
 
+    # TorchAO weight-only quantization: swap the (rotated) linears for fused
+    # dequant-matmul kernels. Alternative to the fake-quant GPTQ/RTN path above.
+    if args.torchao_quant is not None:
+        assert args.w_bits == 16, 'TorchAO weight-only quantization replaces the GPTQ/RTN path (w_bits must be 16)!'
+        torchao_quant.quantize_rotated(model, scheme=args.torchao_quant, group_size=args.torchao_group_size)
+
     if args.k_bits < 16:
         if args.k_pre_rope:
             raise NotImplementedError("Pre-RoPE quantization is not supported yet!")
@@ -122,6 +122,12 @@ def parser_gen():
     parser.add_argument('--int8_down_proj', action=argparse.BooleanOptionalAction, default=False,
                         help='Use INT8 for Down Projection! If this set, '
                              'both weights and activations of this layer will be in INT8')
+    parser.add_argument('--torchao_quant', type=str, default=None,
+                        choices=['int4_weight_only', 'int8_weight_only'],
+                        help='Quantize the weights with TorchAO weight-only kernels after rotation. '
+                             'This is an alternative to the GPTQ/RTN path and requires w_bits=16')
+    parser.add_argument('--torchao_group_size', type=int, default=128,
+                        help='Groupsize for TorchAO int4 weight-only quantization')
 
     # KV-Cache Quantization Arguments
     parser.add_argument('--v_bits', type=int, default=16,
@@ -25,6 +25,10 @@ def evaluator(model, testenc, dev, args):
     model.config.use_cache = False
 
     layers = model.model.layers
+    # TorchAO-quantized models are already fully resident on dev (quantize_rotated
+    # moved them there), and the int4 tinygemm layout refuses to be moved back to
+    # CPU, so the streaming offload below must be skipped for them.
+    offload = not getattr(model, 'torchao_quantized', False)
     model.model.embed_tokens = model.model.embed_tokens.to(dev)
     if hasattr(model.model, "rotary_emb"):
         model.model.rotary_emb = model.model.rotary_emb.to(dev)
@@ -73,9 +77,9 @@ def evaluator(model, testenc, dev, args):
         except ValueError:
             pass
     layers[0] = layers[0].module
-    layers[0] = layers[0].cpu()
-
-    model.model.embed_tokens = model.model.embed_tokens.cpu()
+    if offload:
+        layers[0] = layers[0].cpu()
+        model.model.embed_tokens = model.model.embed_tokens.cpu()
     position_ids = cache["position_ids"]
 
     torch.cuda.empty_cache()
@@ -100,7 +104,8 @@ def evaluator(model, testenc, dev, args):
                 #  defined.
                 position_ids=position_ids,
             )[0]
-        layers[i] = layer.cpu()
+        if offload:
+            layers[i] = layer.cpu()
         del layer
         torch.cuda.empty_cache()
         inps, outs = outs, inps
@@ -231,6 +231,82 @@ def apply_exact_had_to_linear(module, had_dim=-1, output=False):
         module.bias.data = bias_.to(device=dev, dtype=dtype)
 
 
+def apply_exact_had_to_linears(modules, had_dim=-1, output=False, chunk_size=8):
+    """Batched apply_exact_had_to_linear.
+
+    Stacks same-shape linears chunk_size at a time and runs the transform once per
+    chunk, replacing one kernel sequence per layer with one per chunk. Chunking keeps
+    the device footprint bounded: an fp32 stack of every layer's weight (plus the
+    transform output) would be O(model size) and OOM on consumer cards. Used by
+    rotate_model, where every decoder layer needs the identical transform.
+    """
+    modules = list(modules)
+    assert len(modules) > 0
+    for module in modules:
+        assert isinstance(module, torch.nn.Linear)
+    in_features, out_features = modules[0].in_features, modules[0].out_features
+    assert all(m.in_features == in_features and m.out_features == out_features for m in modules)
+
+    if had_dim != -1:
+        assert is_pow2(had_dim), "Hadamard dimension must be a power of 2!"
+
+    for start in range(0, len(modules), chunk_size):
+        _apply_exact_had_to_stack(modules[start:start + chunk_size], had_dim, output)
+
+
+def _apply_exact_had_to_stack(modules, had_dim, output):
+    in_features, out_features = modules[0].in_features, modules[0].out_features
+    dtype = modules[0].weight.dtype
+    dev = modules[0].weight.device
+    # Move the chunk to device in its storage dtype and upcast there: .float() on the
+    # host would materialize a second full-size fp32 copy in CPU memory first.
+    W_ = torch.stack([m.weight.data for m in modules]).cuda().float()
+    has_bias = all(m.bias is not None for m in modules)
+    assert has_bias or all(m.bias is None for m in modules)
+    bias_ = torch.stack([m.bias.data for m in modules]).cuda().float() if has_bias else None
+
+    if had_dim == -1:
+        if output:
+            had_K, K = get_hadK(out_features)
+            W_ = matmul_hadU_cuda(W_.transpose(-2, -1).contiguous(), had_K, K).transpose(-2, -1)
+        if not output:
+            had_K, K = get_hadK(in_features)
+            W_ = matmul_hadU_cuda(W_, had_K, K)
+        if bias_ is not None:
+            raise NotImplementedError
+    else:
+        hadK = hadamard_matrix(had_dim, "cuda").to(torch.float32)
+        if len(hadK.shape) == 2:
+            hadK = hadK.unsqueeze(0)
+        if output:
+            W_ = W_.transpose(-2, -1)
+            transposed_shape = W_.shape
+            temp = W_.reshape(-1, transposed_shape[-1] // had_dim, had_dim)
+            hadK = repeat_rotate(hadK, temp)
+            temp = torch.einsum('b h c, h c i -> b h i', temp.to(torch.float32), hadK.to(torch.float32))
+            W_ = temp.reshape(transposed_shape).transpose(-2, -1)
+            if bias_ is not None:
+                temp = bias_.reshape(-1, transposed_shape[-1] // had_dim, had_dim)
+                bias_ = torch.einsum('b h c, h c i -> b h i', temp.to(torch.float32), hadK.to(torch.float32))
+                bias_ = bias_.reshape(len(modules), -1)
+        else:
+            init_shape = W_.shape
+            temp = W_.reshape(-1, init_shape[-1] // had_dim, had_dim)
+            hadK = repeat_rotate(hadK, temp)
+            temp = torch.einsum('b h c, h c i -> b h i', temp.to(torch.float32), hadK.to(torch.float32))
+            W_ = temp.reshape(init_shape)
+            if bias_ is not None:
+                raise NotImplementedError
+
+    W_ = W_.to(device=dev, dtype=dtype)
+    for module, W_new in zip(modules, W_):
+        module.weight.data = W_new.contiguous()
+    if bias_ is not None:
+        bias_ = bias_.to(device=dev, dtype=dtype)
+        for module, b_new in zip(modules, bias_):
+            module.bias.data = b_new
+
+
 def is_pow2(n):
     return (n & (n - 1) == 0) and (n > 0)
 
@@ -1,5 +1,6 @@
 import logging
 import os
+from collections import namedtuple
 from typing import List
 
 import torch
@@ -16,53 +17,65 @@ MISTRAL_LAYER = MistralDecoderLayer
 QW_MODEL = Qwen2ForCausalLM
 QW_LAYER = Qwen2DecoderLayer
 
-
-def model_type_extractor(model):
-    if isinstance(model, LLAMA_MODEL):
-        return LLAMA_MODEL
-    elif isinstance(model, MISTRAL_MODEL):
-        return MISTRAL_MODEL
-    elif isinstance(model, QW_MODEL):
-        return QW_MODEL
-    else:
-        raise ValueError(f'Unknown model type {model}')
+# Per-model-type accessors, keyed by the *ForCausalLM class. The get_* helpers below are
+# called inside per-layer loops, so they dispatch through this dict with an O(1)
+# type(model) lookup instead of re-running a chain of isinstance checks every call.
+# Supporting a new model type is one entry here.
+ModelSpec = namedtuple('ModelSpec', ['layer_cls', 'rms_cls', 'rope_name',
+                                     'get_layers', 'get_embeddings', 'get_lm_head', 'get_norm'])
+
+_MODEL_REGISTRY = {
+    LLAMA_MODEL: ModelSpec(LLAMA_LAYER, LlamaRMSNorm, 'apply_rotary_pos_emb',
+                           lambda model: model.model.layers,
+                           lambda model: [model.model.embed_tokens],
+                           lambda model: model.lm_head,
+                           lambda model: model.model.norm),
+    MISTRAL_MODEL: ModelSpec(MISTRAL_LAYER, MistralRMSNorm, 'apply_rotary_pos_emb',
+                             lambda model: model.model.layers,
+                             lambda model: [model.model.embed_tokens],
+                             lambda model: model.lm_head,
+                             lambda model: model.model.norm),
+    QW_MODEL: ModelSpec(QW_LAYER, Qwen2RMSNorm, 'apply_rotary_pos_emb',
+                        lambda model: model.model.layers,
+                        lambda model: [model.model.embed_tokens],
+                        lambda model: model.lm_head,
+                        lambda model: model.model.norm),
+}
+
+
+def _lookup_model_type(model):
+    # Exact-type hit first; subclasses fall back to the MRO walk.
+    model_cls = type(model)
+    if model_cls in _MODEL_REGISTRY:
+        return model_cls
+    for cls in model_cls.__mro__:
+        if cls in _MODEL_REGISTRY:
+            return cls
+    raise ValueError(f'Unknown model type {model}')
 
 
-def skip(*args, **kwargs):
-    # This is a helper function to save time during the initialization! 
-    pass
+def model_type_extractor(model):
+    return _lookup_model_type(model)
 
 
 def get_rope_function_name(model):
-    if isinstance(model, LLAMA_MODEL):
-        return "apply_rotary_pos_emb"
-    elif isinstance(model, MISTRAL_MODEL):
-        return "apply_rotary_pos_emb"
-    elif isinstance(model, QW_MODEL):
-        return "apply_rotary_pos_emb"
-    else:
-        raise NotImplementedError
+    return _MODEL_REGISTRY[_lookup_model_type(model)].rope_name
 
 
 def get_layers(model):
-    if isinstance(model, LLAMA_MODEL):
-        return model.model.layers
-    elif isinstance(model, MISTRAL_MODEL):
-        return model.model.layers
-    elif isinstance(model, QW_MODEL):
-        return model.model.layers
-    raise NotImplementedError
+    return _MODEL_REGISTRY[_lookup_model_type(model)].get_layers(model)
 
 
 def get_llama(model_name, hf_token):
-    torch.nn.init.kaiming_uniform_ = skip
-    torch.nn.init.uniform_ = skip
-    torch.nn.init.normal_ = skip
+    # from_pretrained's fast-init path (the default) already skips the random weight
+    # initializers, so no torch.nn.init monkey-patching is needed; low_cpu_mem_usage
+    # loads the checkpoint without a second in-memory copy.
     model = LlamaForCausalLM.from_pretrained(
         model_name,
         torch_dtype=torch.float16,
         use_auth_token=hf_token,
-        low_cpu_mem_usage=True
+        low_cpu_mem_usage=True,
+        attn_implementation="sdpa"
     )
     model.seqlen = 2048
     logging.info('---> Loading {} Model with seq_len: {}'.format(model_name, model.seqlen))
@@ -70,14 +83,15 @@ def get_llama(model_name, hf_token):
 
 
 def get_mistral(model_name, hf_token):
-    torch.nn.init.kaiming_uniform_ = skip
-    torch.nn.init.uniform_ = skip
-    torch.nn.init.normal_ = skip
+    # from_pretrained's fast-init path (the default) already skips the random weight
+    # initializers, so no torch.nn.init monkey-patching is needed; low_cpu_mem_usage
+    # loads the checkpoint without a second in-memory copy.
     model = MistralForCausalLM.from_pretrained(
         model_name,
         torch_dtype=torch.float16,
         use_auth_token=hf_token,
-        low_cpu_mem_usage=True
+        low_cpu_mem_usage=True,
+        attn_implementation="sdpa"
     )
     model.seqlen = 2048
     logging.info('---> Loading {} Model with seq_len: {}'.format(model_name, model.seqlen))
@@ -85,14 +99,15 @@ def get_mistral(model_name, hf_token):
 
 
 def get_qwen(model_name, hf_token):
-    torch.nn.init.kaiming_uniform_ = skip
-    torch.nn.init.uniform_ = skip
-    torch.nn.init.normal_ = skip
+    # from_pretrained's fast-init path (the default) already skips the random weight
+    # initializers, so no torch.nn.init monkey-patching is needed; low_cpu_mem_usage
+    # loads the checkpoint without a second in-memory copy.
     model = Qwen2ForCausalLM.from_pretrained(
         model_name,
         torch_dtype=torch.float16,
         use_auth_token=hf_token,
-        low_cpu_mem_usage=True
+        low_cpu_mem_usage=True,
+        attn_implementation="sdpa"
     )
     model.seqlen = 2048
     logging.info('---> Loading {} Model with seq_len: {}'.format(model_name, model.seqlen))
@@ -114,83 +129,50 @@ def get_model(model_name, hf_token=None):
 
 
 def get_model_type(model):
-    if isinstance(model, LLAMA_MODEL):
-        model_type = LLAMA_MODEL
-    elif isinstance(model, MISTRAL_MODEL):
-        model_type = MISTRAL_MODEL
-    elif isinstance(model, QW_MODEL):
-        model_type = QW_MODEL
-    else:
-        raise ValueError(f'Unknown model type {model}')
-    return model_type
+    return _lookup_model_type(model)
 
 
 def get_embeddings(model, model_type) -> List[torch.nn.Module]:
-    if model_type == LLAMA_MODEL:
-        return [model.model.embed_tokens]
-    elif model_type == MISTRAL_MODEL:
-        return [model.model.embed_tokens]
-    elif model_type == QW_MODEL:
-        return [model.model.embed_tokens]
-    else:
+    if model_type not in _MODEL_REGISTRY:
         raise ValueError(f'Unknown model type {model_type}')
+    return _MODEL_REGISTRY[model_type].get_embeddings(model)
 
 
 def get_transformer_layers(model, model_type):
-    if model_type == LLAMA_MODEL:
-        return [layer for layer in model.model.layers]
-    elif model_type == MISTRAL_MODEL:
-        return [layer for layer in model.model.layers]
-    elif model_type == QW_MODEL:
-        return [layer for layer in model.model.layers]
-    else:
+    # The ModuleList is already iterable and indexable; no need to copy it into a list.
+    if model_type not in _MODEL_REGISTRY:
         raise ValueError(f'Unknown model type {model_type}')
+    return _MODEL_REGISTRY[model_type].get_layers(model)
 
 
 def get_lm_head(model, model_type):
-    if model_type == LLAMA_MODEL:
-        return model.lm_head
-    elif model_type == MISTRAL_MODEL:
-        return model.lm_head
-    elif model_type == QW_MODEL:
-        return model.lm_head
-    else:
+    if model_type not in _MODEL_REGISTRY:
         raise ValueError(f'Unknown model type {model_type}')
+    return _MODEL_REGISTRY[model_type].get_lm_head(model)
 
 
 def get_pre_head_layernorm(model, model_type):
-    if model_type == LLAMA_MODEL:
-        pre_head_layernorm = model.model.norm
-        assert isinstance(pre_head_layernorm, LlamaRMSNorm)
-    elif model_type == MISTRAL_MODEL:
-        pre_head_layernorm = model.model.norm
-        assert isinstance(pre_head_layernorm, MistralRMSNorm)
-    elif model_type == QW_MODEL:
-        pre_head_layernorm = model.model.norm
-        assert isinstance(pre_head_layernorm, Qwen2RMSNorm)
-    else:
+    if model_type not in _MODEL_REGISTRY:
         raise ValueError(f'Unknown model type {model_type}')
+    spec = _MODEL_REGISTRY[model_type]
+    pre_head_layernorm = spec.get_norm(model)
+    assert isinstance(pre_head_layernorm, spec.rms_cls)
     return pre_head_layernorm
 
 
 def get_mlp_bottleneck_size(model):
-    model_type = get_model_type(model)
-    if model_type == LLAMA_MODEL:
-        return model.config.intermediate_size
-    elif model_type == MISTRAL_MODEL:
-        return model.config.intermediate_size
-    elif model_type == QW_MODEL:
-        return model.config.intermediate_size
-    else:
-        raise ValueError(f'Unknown model type {model_type}')
+    _lookup_model_type(model)  # validates the model type
+    return model.config.intermediate_size
 
 
 def replace_modules(root: torch.nn.Module, type_to_replace, new_module_factory, replace_layers: bool) -> None:
     """Replace modules of given type using the supplied module factory.
 
-    Perform a depth-first search of a module hierarchy starting at root
-    and replace all instances of type_to_replace with modules created by
-    new_module_factory. Children of replaced modules are not processed.
+    Walk the module hierarchy starting at root with an explicit stack (models have
+    thousands of submodules, so this avoids one Python frame per node and any
+    recursion-depth concerns) and replace all instances of type_to_replace with
+    modules created by new_module_factory. Children of replaced modules are not
+    processed.
 
     Args:
         root: the root of the module hierarchy where modules should be replaced
@@ -198,31 +180,54 @@ def replace_modules(root: torch.nn.Module, type_to_replace, new_module_factory,
         new_module_factory: a function that given a module that should be replaced
             produces a module to replace it with.
     """
-    for name, module in root.named_children():
-        new_module = None
-        if isinstance(module, type_to_replace):
-            if replace_layers:  # layernorm_fusion.replace_layers case where transformer layers are replaced
-                new_module = new_module_factory(module, int(name))
-            else:  # layernorm_fusion.fuse_modules case where layernorms are fused
-                new_module = new_module_factory(module)
-        elif len(list(module.children())) > 0:
-            replace_modules(module, type_to_replace, new_module_factory, replace_layers)
-
-        if new_module is not None:
-            setattr(root, name, new_module)
+    stack = [root]
+    while stack:
+        parent = stack.pop()
+        # _modules is the OrderedDict behind named_children(); iterate it directly and
+        # snapshot it with list() since setattr mutates it.
+        for name, module in list(parent._modules.items()):
+            if module is None:
+                continue
+            if isinstance(module, type_to_replace):
+                if replace_layers:  # layernorm_fusion.replace_layers case where transformer layers are replaced
+                    new_module = new_module_factory(module, int(name))
+                else:  # layernorm_fusion.fuse_modules case where layernorms are fused
+                    new_module = new_module_factory(module)
+                if new_module is not None:
+                    setattr(parent, name, new_module)
+            elif module._modules:
+                stack.append(module)
 
 
 def get_layer_io_save_path(args):
     return os.path.join(args.save_path, 'layer_io', f'{args.layer_idx:03d}.pt')
 
 
-def capture_layer_io(model_type, layer, layer_input):
+def capture_layer_io(model_type, layer, layer_input, micro_batch=4):
+    nseqs, seqlen = layer_input.shape[0], layer_input.shape[1]
+    use_cuda = torch.cuda.is_available()
+    # One pinned slab per captured tensor, allocated once up front. Pinning is a
+    # cudaHostAlloc — expensive and potentially device-synchronizing — so allocating
+    # inside the hooks on every call would cost more than the async copies save.
+    pinned_slabs = {}
+    fill_counts = {}
+
+    def alloc_slab(module, is_input):
+        features = module.weight.shape[1] if is_input else module.weight.shape[0]
+        return torch.empty(nseqs, seqlen, features, dtype=layer_input.dtype, pin_memory=True)
+
     def hook_factory(module_name, captured_vals, is_input):
+        # Copy into the preallocated pinned slab with non_blocking=True so every hook
+        # enqueues an async D2H copy instead of synchronizing the forward pass on PCIe;
+        # the single torch.cuda.synchronize() after the capture loop fences all of them.
         def hook(module, input, output):
-            if is_input:
-                captured_vals[module_name].append(input[0].detach().cpu())
+            val = (input[0] if is_input else output).detach()
+            if val.is_cuda:
+                start = fill_counts[module_name]
+                pinned_slabs[module_name][start:start + val.shape[0]].copy_(val, non_blocking=True)
+                fill_counts[module_name] = start + val.shape[0]
             else:
-                captured_vals[module_name].append(output.detach().cpu())
+                captured_vals[module_name].append(val.cpu())
 
         return hook
 
@@ -242,26 +247,57 @@ def capture_layer_io(model_type, layer, layer_input):
 
         for name in captured_inputs.keys():
             module = getattr(layer.self_attn, name, None) or getattr(layer.mlp, name, None)
+            if use_cuda:
+                pinned_slabs[name] = alloc_slab(module, is_input=True)
+                fill_counts[name] = 0
             handles.append(module.register_forward_hook(hook_factory(name, captured_inputs, True)))
 
         for name in captured_outputs.keys():
             module = getattr(layer.self_attn, name, None) or getattr(layer.mlp, name, None)
+            if use_cuda:
+                pinned_slabs[name] = alloc_slab(module, is_input=False)
+                fill_counts[name] = 0
             handles.append(module.register_forward_hook(hook_factory(name, captured_outputs, False)))
     else:
         raise ValueError(f'Unknown model type {model_type}')
 
-    # Process each sequence in the batch one by one to avoid OOM.
-    for seq_idx in range(layer_input.shape[0]):
-        # Extract the current sequence across all dimensions.
-        seq = layer_input[seq_idx:seq_idx + 1].to(misc.DEV)
-        # Perform a forward pass for the current sequence.
-        layer(seq)
+    # Process the batch in micro-batches (instead of one sequence at a time) to avoid OOM.
+    # On CUDA, prefetch the next micro-batch on a side stream so the H2D copy of batch i+1
+    # overlaps with the forward pass of batch i instead of stalling on PCIe.
+    if use_cuda:
+        if layer_input.device.type == 'cpu':
+            # Pinned memory is required for the copies to actually be asynchronous.
+            layer_input = layer_input.pin_memory()
+        copy_stream = torch.cuda.Stream()
+        compute_stream = torch.cuda.current_stream()
+        with torch.cuda.stream(copy_stream):
+            prefetched = layer_input[0:micro_batch].to(misc.DEV, non_blocking=True)
+        for start in range(0, nseqs, micro_batch):
+            compute_stream.wait_stream(copy_stream)
+            seqs = prefetched
+            seqs.record_stream(compute_stream)
+            if start + micro_batch < nseqs:
+                with torch.cuda.stream(copy_stream):
+                    prefetched = layer_input[start + micro_batch:start + 2 * micro_batch].to(
+                        misc.DEV, non_blocking=True)
+            layer(seqs)
+        torch.cuda.synchronize()
+    else:
+        for start in range(0, nseqs, micro_batch):
+            layer(layer_input[start:start + micro_batch].to(misc.DEV))
 
-    # After processing all sequences, concatenate the accumulated inputs for each sub-layer across the batch.
+    # After processing all sequences, the pinned slabs already hold the whole capture;
+    # the CPU fallback concatenates its per-micro-batch list as before.
     for module_name in captured_inputs:
-        captured_inputs[module_name] = torch.cat(captured_inputs[module_name], dim=0)
+        if module_name in pinned_slabs:
+            captured_inputs[module_name] = pinned_slabs[module_name][:fill_counts[module_name]]
+        else:
+            captured_inputs[module_name] = torch.cat(captured_inputs[module_name], dim=0)
     for module_name in captured_outputs:
-        captured_outputs[module_name] = torch.cat(captured_outputs[module_name], dim=0)
+        if module_name in pinned_slabs:
+            captured_outputs[module_name] = pinned_slabs[module_name][:fill_counts[module_name]]
+        else:
+            captured_outputs[module_name] = torch.cat(captured_outputs[module_name], dim=0)
 
     # Cleanup.
     for h in handles:
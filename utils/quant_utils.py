@@ -183,6 +183,34 @@ class ActQuantizer(torch.nn.Module):
         self.scale = self.scale.repeat(1, 1, 1, self.groupsize).reshape(init_shape)
         self.zero = self.zero.repeat(1, 1, 1, self.groupsize).reshape(init_shape)
 
+    def find_params_reduce(self, x, dims):
+        '''
+        Per-token quantization params reduced over an arbitrary set of dims (keepdim),
+        so callers can quantize in their natural memory layout instead of transposing
+        the token dim to the front. scale/zero are left broadcastable against x.
+        '''
+        if self.bits == 16:
+            return
+
+        self.maxq = self.maxq.to(x.device)
+        xmin = x.amin(dim=dims, keepdim=True)
+        xmax = x.amax(dim=dims, keepdim=True)
+        tmp = torch.zeros_like(xmin)
+        xmin = torch.minimum(xmin, tmp) * self.clip_ratio
+        xmax = torch.maximum(xmax, tmp) * self.clip_ratio
+        if self.sym:
+            xmax = torch.maximum(torch.abs(xmin), xmax)
+            tmp = xmax == 0
+            self.scale = xmax / self.maxq
+            self.scale[tmp] = 1
+            self.zero = torch.zeros_like(self.scale)
+        else:
+            tmp = (xmin == 0) & (xmax == 0)
+            xmin[tmp] = -1
+            xmax[tmp] = +1
+            self.scale = (xmax - xmin) / self.maxq
+            self.zero = torch.round(-xmin / self.scale)
+
     def find_params(self, x):
         if self.bits == 16:
             return
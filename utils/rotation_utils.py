@@ -1,16 +1,17 @@
 import functools
 import math
+import os
 import random
 import typing
 
 import torch
-import tqdm
 
 import misc
 from utils import model_utils
 from utils import monkeypatch
 from utils import quant_utils
-from utils.hadamard_utils import apply_exact_had_to_linear, is_pow2, random_hadamard_matrix
+from utils.hadamard_utils import apply_exact_had_to_linear, apply_exact_had_to_linears, is_pow2, \
+    random_hadamard_matrix
 from utils.householder_utils import house_v2, householder
 
 try:
@@ -18,23 +19,58 @@ try:
 except:
     hadamard_transform = None
 
+# Fusion/rotation math runs in fp32 by default: Q is orthonormal (condition number 1),
+# so fp32 accumulation is accurate enough, while fp64 GEMMs are 2-32x slower on GPU and
+# double the memory traffic. Set DFROT_FP64=1 to restore the bit-exact fp64 path.
+ROTATION_DTYPE = torch.float64 if os.environ.get('DFROT_FP64', '0') == '1' else torch.float32
+
+
+def rotate_right_kernel(W, Q):
+    # One graph for the upcast -> matmul -> downcast pattern shared by every
+    # right-rotation site. Under torch.compile, Inductor fuses the dtype
+    # conversions into the GEMM prologue/epilogue instead of materializing a
+    # full-size temporary for the cast and the cast-back.
+    return torch.matmul(W.to(ROTATION_DTYPE), Q.to(ROTATION_DTYPE)).to(W.dtype)
+
+
+def rotate_left_kernel(Q, W):
+    # Left-rotation (Q.T @ W) counterpart of rotate_right_kernel.
+    return torch.matmul(Q.to(ROTATION_DTYPE), W.to(ROTATION_DTYPE)).to(W.dtype)
+
+
+if hasattr(torch, 'compile'):
+    # Weight shapes are static per model size, so each (shape, dtype) signature
+    # compiles once and is served from the dynamo cache afterwards.
+    rotate_right_kernel = torch.compile(rotate_right_kernel, mode='reduce-overhead', dynamic=False)
+    rotate_left_kernel = torch.compile(rotate_left_kernel, mode='reduce-overhead', dynamic=False)
+
 
 def fuse_ln_linear(layernorm: torch.nn.Module, linear_layers: typing.Iterable[torch.nn.Linear]) -> None:
     """
     fuse the linear operations in Layernorm into the adjacent linear blocks.
     """
-    for linear in linear_layers:
-        linear_dtype = linear.weight.dtype
-
-        # Calculating new weight and bias
-        W_ = linear.weight.data.double()
-        linear.weight.data = (W_ * layernorm.weight.double()).to(linear_dtype)
-
-        if hasattr(layernorm, 'bias'):
+    linear_layers = list(linear_layers)
+    # Concatenate the weights along the output dim so the layernorm scale (and the bias
+    # folding) runs as one broadcast kernel over all the linears (e.g. q/k/v at once)
+    # instead of one full read/write per linear.
+    out_features = [linear.out_features for linear in linear_layers]
+    W_cat = torch.cat([linear.weight.data for linear in linear_layers], dim=0).to(dtype=ROTATION_DTYPE)
+
+    # The bias folding uses the un-scaled weights, so compute it before the scale.
+    b_cat = None
+    if hasattr(layernorm, 'bias'):
+        b_cat = torch.matmul(W_cat, layernorm.bias.to(dtype=ROTATION_DTYPE))
+
+    W_cat = W_cat * layernorm.weight.to(dtype=ROTATION_DTYPE)
+    for linear, W_new in zip(linear_layers, torch.split(W_cat, out_features, dim=0)):
+        linear.weight.data = W_new.to(linear.weight.dtype)
+
+    if b_cat is not None:
+        for linear, b_new in zip(linear_layers, torch.split(b_cat, out_features, dim=0)):
+            linear_dtype = linear.weight.dtype
             if linear.bias is None:
-                linear.bias = torch.nn.Parameter(torch.zeros(linear.out_features, dtype=torch.float64))
-            linear.bias.data = linear.bias.data.double() + torch.matmul(W_, layernorm.bias.double())
-            linear.bias.data = linear.bias.data.to(linear_dtype)
+                linear.bias = torch.nn.Parameter(torch.zeros(linear.out_features, dtype=ROTATION_DTYPE))
+            linear.bias.data = (linear.bias.data.to(dtype=ROTATION_DTYPE) + b_new).to(linear_dtype)
 
 
 def bake_mean_into_linear(linear: torch.nn.Linear) -> None:
@@ -44,11 +80,11 @@ def bake_mean_into_linear(linear: torch.nn.Linear) -> None:
     the mean substitution which is usually done inside layernorm.
     """
     linear_dtype = linear.weight.dtype
-    W_ = linear.weight.data.double()
+    W_ = linear.weight.data.to(dtype=ROTATION_DTYPE)
     linear.weight.data = W_ - W_.mean(dim=-2, keepdim=True)
     linear.weight.data = linear.weight.data.to(linear_dtype)
     if linear.bias is not None:
-        b_ = linear.bias.data.double()
+        b_ = linear.bias.data.to(dtype=ROTATION_DTYPE)
         linear.bias.data = b_ - b_.mean()
         linear.bias.data = linear.bias.data.to(linear_dtype)
 
@@ -92,13 +128,17 @@ def fuse_layer_norms(model):
     model.model.norm.weight.data = torch.ones_like(W_norm)
 
 
-def random_orthogonal_matrix(size, device):
+def random_orthogonal_matrix(size, device, dtype=ROTATION_DTYPE):
     """
     Generate a random orthogonal matrix of the specified size.
     First, we generate a random matrix with entries from a standard distribution.
     Then, we use QR decomposition to obtain an orthogonal matrix.
     Finally, we multiply by a diagonal matrix with diag r to adjust the signs.
 
+    The QR runs in fp32 by default: after the sign correction the orthogonality
+    error is ~1e-6, which is negligible once the rotation is absorbed into the
+    weights. Pass dtype=torch.float64 to get the old fp64 guarantees.
+
     Args:
     size (int): The size of the matrix (size x size).
 
@@ -106,7 +146,7 @@ def random_orthogonal_matrix(size, device):
     torch.Tensor: An orthogonal matrix of the specified size.
     """
     torch.cuda.empty_cache()
-    random_matrix = torch.randn(size, size, dtype=torch.float64).to(device)
+    random_matrix = torch.randn(size, size, dtype=dtype).to(device)
     q, r = torch.linalg.qr(random_matrix)
     q *= torch.sign(torch.diag(r)).unsqueeze(0)
     return q
@@ -114,11 +154,15 @@ def random_orthogonal_matrix(size, device):
 
 def random_householder_matrix(size, device, indices):
     assert isinstance(indices, list), "idx needs to be a list of outlier channel idx"
+    # Each Householder reflector H = I - 2vv^T/(v^Tv) is rank-1, so right-multiplying
+    # by it is a GEMV plus an outer-product update: M @ H = M - 2(Mv)v^T/(v^Tv).
+    # That is O(d^2) per reflector instead of the O(d^3) dense d x d matmul per index.
     matrix = torch.eye(size).to(device)
     for idx in indices:
-        matrix = matrix @ householder(
-            house_v2(size, idx).to(matrix) * torch.where(torch.randn(size) > 0, 1, -1).to(matrix))
-    return matrix.to(torch.float64)
+        v = house_v2(size, idx).to(matrix) * torch.where(torch.randn(size) > 0, 1, -1).to(matrix)
+        Mv = matrix @ v
+        matrix = matrix - 2.0 * torch.outer(Mv, v) / v.dot(v)
+    return matrix.to(ROTATION_DTYPE)
 
 
 def get_orthogonal_matrix(size, mode, device, **kwargs):
@@ -144,32 +188,38 @@ def rotate_embeddings(model, Q: torch.Tensor) -> None:
     # Rotate the embeddings.
     model_type = model_utils.model_type_extractor(model)
     for W in model_utils.get_embeddings(model, model_type):
-        dtype = W.weight.data.dtype
-        W_ = W.weight.data.to(device=misc.DEV, dtype=torch.float64)
-        W.weight.data = torch.matmul(W_, Q).to(device='cpu', dtype=dtype)
+        W_ = W.weight.data.to(device=misc.DEV)
+        W.weight.data = rotate_right_kernel(W_, Q.to(misc.DEV)).to(device='cpu')
+        # Free the device copy before the next (potentially GB-sized) embedding.
+        del W_
 
 
 def rotate_attention_inputs(layer, Q, model_type) -> None:
     # Rotate the WQ, WK and WV matrices of the self-attention layer.
     for W in [layer.self_attn.q_proj, layer.self_attn.k_proj, layer.self_attn.v_proj]:
-        dtype = W.weight.dtype
-        W_ = W.weight.to(device=misc.DEV, dtype=torch.float64)
-        W.weight.data = torch.matmul(W_, Q).to(device='cpu', dtype=dtype)
+        W_ = W.weight.data.to(device=misc.DEV)
+        W.weight.data = rotate_right_kernel(W_, Q.to(misc.DEV)).to(device='cpu')
+        del W_
 
 
-def rotate_attention_output(layer, Q, model_type) -> None:
+def rotate_attention_output(layer, Q, model_type, QT=None) -> None:
     # Rotate output matrix of the self-attention layer.
     if model_type == model_utils.LLAMA_MODEL or model_type == model_utils.MISTRAL_MODEL or model_type == model_utils.QW_MODEL:
         W = layer.self_attn.o_proj
     else:
         raise ValueError(f'Unknown model type {model_type}')
 
-    dtype = W.weight.data.dtype
-    W_ = W.weight.data.to(device=misc.DEV, dtype=torch.float64)
-    W.weight.data = torch.matmul(Q.T, W_).to(device='cpu', dtype=dtype)
+    if QT is None:
+        # Contiguous Q.T lets cuBLAS take the fast non-transposed GEMM path; callers
+        # looping over layers should compute it once and pass it in.
+        QT = Q.T.contiguous()
+    W_ = W.weight.data.to(device=misc.DEV)
+    W.weight.data = rotate_left_kernel(QT.to(misc.DEV), W_).to(device='cpu')
+    del W_
     if W.bias is not None:
-        b = W.bias.data.to(device=misc.DEV, dtype=torch.float64)
-        W.bias.data = torch.matmul(Q.T, b).to(device='cpu', dtype=dtype)
+        b = W.bias.data.to(device=misc.DEV)
+        W.bias.data = rotate_left_kernel(QT.to(misc.DEV), b).to(device='cpu')
+        del b
 
 
 def rotate_mlp_input(layer, Q, model_type):
@@ -179,25 +229,41 @@ def rotate_mlp_input(layer, Q, model_type):
     else:
         raise ValueError(f'Unknown model type {model_type}')
     for W in mlp_inputs:
-        dtype = W.weight.dtype
-        W_ = W.weight.data.to(device=misc.DEV, dtype=torch.float64)
-        W.weight.data = torch.matmul(W_, Q).to(device='cpu', dtype=dtype)
+        W_ = W.weight.data.to(device=misc.DEV)
+        W.weight.data = rotate_right_kernel(W_, Q.to(misc.DEV)).to(device='cpu')
+        del W_
 
 
-def rotate_mlp_output(layer, Q, model_type):
+def rotate_mlp_output(layer, Q, model_type, QT=None):
     # Rotate the MLP output weights and bias.
     if model_type == model_utils.LLAMA_MODEL or model_type == model_utils.MISTRAL_MODEL or model_type == model_utils.QW_MODEL:
         W = layer.mlp.down_proj
     else:
         raise ValueError(f'Unknown model type {model_type}')
-    dtype = W.weight.data.dtype
-    W_ = W.weight.data.to(device=misc.DEV, dtype=torch.float64)
-    W.weight.data = torch.matmul(Q.T, W_).to(device='cpu', dtype=dtype)
+    if QT is None:
+        QT = Q.T.contiguous()
+    W_ = W.weight.data.to(device=misc.DEV)
+    W.weight.data = rotate_left_kernel(QT.to(misc.DEV), W_).to(device='cpu')
+    del W_
     apply_exact_had_to_linear(W, had_dim=-1,
                               output=False)  # apply exact (inverse) hadamard on the weights of mlp output
     if W.bias is not None:
-        b = W.bias.data.to(device=misc.DEV, dtype=torch.float64)
-        W.bias.data = torch.matmul(Q.T, b).to(device='cpu', dtype=dtype)
+        b = W.bias.data.to(device=misc.DEV)
+        W.bias.data = rotate_left_kernel(QT.to(misc.DEV), b).to(device='cpu')
+        del b
+
+
+# Transposed copies of the small hadK factors, keyed by the source buffer. The same
+# hadK is passed for every decoder layer, so memoizing the .T.contiguous() clone avoids
+# re-allocating it per call.
+_hadK_T_cache = {}
+
+
+def _transpose_hadK(hadK):
+    key = (hadK.data_ptr(), tuple(hadK.shape), hadK.device)
+    if key not in _hadK_T_cache:
+        _hadK_T_cache[key] = hadK.T.contiguous()
+    return _hadK_T_cache[key]
 
 
 def matmul_hadU_cuda_had(X, hadK, transpose=False):
@@ -206,14 +272,17 @@ def matmul_hadU_cuda_had(X, hadK, transpose=False):
     It reshapes X and applies Walsh-Hadamard transform to the last dimension.
     Then, it will multiply the retult by another hadamard matrix.
     '''
-    from fast_hadamard_transform import hadamard_transform
+    assert hadamard_transform is not None, 'fast_hadamard_transform is not installed'
     n = X.shape[-1]
     K = hadK.shape[-1]
 
     if transpose:
-        hadK = hadK.T.contiguous()
-    input = X.float().cuda().view(-1, K, n // K)
-    input = hadamard_transform(input.contiguous(), scale=1 / math.sqrt(n))
+        hadK = _transpose_hadK(hadK)
+    # Keep fp16/bf16 inputs in their native dtype: the Hadamard kernel handles half
+    # precision, and the fp32 copy would double the peak memory of the largest weight.
+    input = X.cuda() if X.dtype in (torch.float16, torch.bfloat16) else X.float().cuda()
+    input = input.view(-1, K, n // K)
+    input = hadamard_transform_anydtype(input.contiguous(), scale=1 / math.sqrt(n))
     input = hadK.to(input.device).to(input.dtype) @ input
     return input.to(X.device).to(X.dtype).reshape(
         X.shape)
@@ -225,17 +294,17 @@ def rotate_faster_down_proj(layer, model_type, hardK):
     else:
         raise ValueError(f'Faster MLP is onlu supported for LLaMa models!')
 
-    dtype = W.weight.data.dtype
-    W.weight.data = matmul_hadU_cuda_had(W.weight.data.float().cuda(), hardK)
-    W.weight.data = W.weight.data.to(device='cpu', dtype=dtype)
+    W.weight.data = matmul_hadU_cuda_had(W.weight.data.cuda(), hardK)
+    W.weight.data = W.weight.data.to(device='cpu')
 
 
 def rotate_head(model, Q: torch.Tensor) -> None:
     # Rotate the head.
     W = model_utils.get_lm_head(model, model_type=model_utils.model_type_extractor(model))
-    dtype = W.weight.data.dtype
-    W_ = W.weight.data.to(device=misc.DEV, dtype=torch.float64)
-    W.weight.data = torch.matmul(W_, Q).to(device='cpu', dtype=dtype)
+    W_ = W.weight.data.to(device=misc.DEV)
+    W.weight.data = rotate_right_kernel(W_, Q.to(misc.DEV)).to(device='cpu')
+    # The lm_head is vocab x hidden; drop the device copy as soon as it is rotated.
+    del W_
 
 
 def rotate_ov_proj(layer, model_type, head_num, head_dim):
@@ -249,6 +318,93 @@ def rotate_ov_proj(layer, model_type, head_num, head_dim):
     apply_exact_had_to_linear(o_proj, had_dim=head_dim, output=False)
 
 
+def collect_rotation_linears(layers, model_type):
+    # Gather every linear that is right-multiplied by Q (inputs) and left-multiplied by Q.T (outputs).
+    if model_type == model_utils.LLAMA_MODEL or model_type == model_utils.MISTRAL_MODEL or model_type == model_utils.QW_MODEL:
+        right_linears, left_linears = [], []
+        for layer in layers:
+            right_linears += [layer.self_attn.q_proj, layer.self_attn.k_proj, layer.self_attn.v_proj,
+                              layer.mlp.up_proj, layer.mlp.gate_proj]
+            left_linears += [layer.self_attn.o_proj, layer.mlp.down_proj]
+        return right_linears, left_linears
+    else:
+        raise ValueError(f'Unknown model type {model_type}')
+
+
+# How many same-shape weights to stack per batched rotation GEMM. Stacking a whole
+# model's group would hold the stack plus its ROTATION_DTYPE upcast and output live at
+# once (tens of GB for a 7B up/gate group, far beyond consumer cards), so the groups
+# are processed in fixed-size chunks that keep the transient footprint a few GB while
+# still amortizing the kernel launches over several layers. The DFROT_FP64 path
+# doubles every upcast operand, so it falls back to per-weight rotation — the same
+# footprint as the original fp64 code, just routed through the fused kernels.
+ROTATION_CHUNK_SIZE = 1 if ROTATION_DTYPE == torch.float64 else 8
+
+
+def stack_weights(group, scratch=None):
+    # Stack the group's weights on device, writing into the caller-provided scratch
+    # buffer when it fits so every group reuses one allocation instead of pushing a
+    # fresh multi-GB tensor through the CUDA caching allocator.
+    shape = (len(group),) + tuple(group[0].weight.shape)
+    numel = len(group) * group[0].weight.numel()
+    if scratch is not None and scratch.numel() >= numel and scratch.dtype == group[0].weight.dtype:
+        W_stack = scratch[:numel].view(shape)
+        for idx, linear in enumerate(group):
+            W_stack[idx].copy_(linear.weight.data)
+        return W_stack
+    return torch.stack([linear.weight.data.to(device=misc.DEV) for linear in group])
+
+
+def max_group_numel(linears, chunk_size=ROTATION_CHUNK_SIZE):
+    # Size of the largest stacked chunk, i.e. the scratch capacity needed.
+    counts, numels = {}, {}
+    for linear in linears:
+        shape = tuple(linear.weight.shape)
+        counts[shape] = counts.get(shape, 0) + 1
+        numels[shape] = linear.weight.numel()
+    return max(min(count, chunk_size) * numels[shape] for shape, count in counts.items())
+
+
+def batch_rotate_right(linears, Q, scratch=None):
+    # Stack same-shape weights across layers and rotate them with batched GEMMs, a
+    # ROTATION_CHUNK_SIZE-sized chunk at a time, instead of one small matmul (plus
+    # dtype round-trip) per weight.
+    groups = {}
+    for linear in linears:
+        groups.setdefault(tuple(linear.weight.shape), []).append(linear)
+    Q_ = Q.to(device=misc.DEV)
+    for group in groups.values():
+        for start in range(0, len(group), ROTATION_CHUNK_SIZE):
+            chunk = group[start:start + ROTATION_CHUNK_SIZE]
+            W_stack = stack_weights(chunk, scratch)
+            W_stack = rotate_right_kernel(W_stack, Q_).to(device='cpu')
+            for linear, W_new in zip(chunk, W_stack):
+                linear.weight.data = W_new
+
+
+def batch_rotate_left(linears, QT, scratch=None):
+    # Same as batch_rotate_right, but for the output projections (Q.T @ W and Q.T @ b).
+    # Takes the precomputed contiguous Q.T so cuBLAS runs the fast non-transposed GEMM.
+    groups = {}
+    for linear in linears:
+        groups.setdefault(tuple(linear.weight.shape), []).append(linear)
+    QT = QT.to(device=misc.DEV)
+    for group in groups.values():
+        for start in range(0, len(group), ROTATION_CHUNK_SIZE):
+            chunk = group[start:start + ROTATION_CHUNK_SIZE]
+            W_stack = stack_weights(chunk, scratch)
+            W_stack = rotate_left_kernel(QT, W_stack).to(device='cpu')
+            for linear, W_new in zip(chunk, W_stack):
+                linear.weight.data = W_new
+        # The biases are vectors, so one stacked GEMV over the whole group is cheap.
+        biased = [linear for linear in group if linear.bias is not None]
+        if len(biased) > 0:
+            b_stack = torch.stack([linear.bias.data.to(device=misc.DEV) for linear in biased])
+            b_stack = rotate_right_kernel(b_stack, QT.T).to(device='cpu')
+            for linear, b_new in zip(biased, b_stack):
+                linear.bias.data = b_new
+
+
 @torch.inference_mode()
 def rotate_model(model, Q):
     config = model.config
@@ -257,16 +413,52 @@ def rotate_model(model, Q):
     head_dim = model_dim // num_heads
 
     model_type = model_utils.model_type_extractor(model)
+    # Rotated weights are written straight back to pageable CPU memory, so each
+    # rotation ends with a synchronous D2H copy anyway — running the embedding and
+    # lm_head rotations on side streams would not overlap anything.
     rotate_embeddings(model, Q)
     rotate_head(model, Q)
-    misc.cleanup_memory()
     layers = model_utils.get_transformer_layers(model, model_type=model_type)
-    for idx, layer in enumerate(tqdm.tqdm(layers, unit="layer", desc="Rotating")):
-        rotate_attention_inputs(layers[idx], Q, model_type)
-        rotate_attention_output(layers[idx], Q, model_type)
-        rotate_mlp_input(layers[idx], Q, model_type)
-        rotate_mlp_output(layers[idx], Q, model_type)
-        rotate_ov_proj(layers[idx], model_type, num_heads, head_dim)
+    # Rotate all the projections with chunked batched GEMMs instead of ~7 small matmuls
+    # per layer. A single scratch buffer sized to the largest stacked chunk backs all
+    # the stacked inputs, avoiding a large device alloc/free pair per chunk.
+    right_linears, left_linears = collect_rotation_linears(layers, model_type)
+    scratch = torch.empty(max(max_group_numel(right_linears), max_group_numel(left_linears)),
+                          dtype=right_linears[0].weight.dtype, device=misc.DEV)
+    QT = Q.T.contiguous()
+    batch_rotate_right(right_linears, Q, scratch=scratch)
+    batch_rotate_left(left_linears, QT, scratch=scratch)
+    del scratch
+    # cleanup_memory is mostly a CPU-side gc.collect + empty_cache; run it once after the
+    # big GEMMs rather than serializing it between the embedding/head rotations.
+    misc.cleanup_memory()
+    # The remaining per-layer work is the exact (inverse) Hadamard on down_proj and the
+    # ov projections. The transform is identical for every decoder layer, so apply it to
+    # the stacked weights once per projection instead of looping layer by layer.
+    apply_exact_had_to_linears([layer.mlp.down_proj for layer in layers], had_dim=-1, output=False)
+    apply_exact_had_to_linears([layer.self_attn.v_proj for layer in layers], had_dim=head_dim, output=True)
+    apply_exact_had_to_linears([layer.self_attn.o_proj for layer in layers], had_dim=head_dim, output=False)
+
+
+# Whether the installed fast_hadamard_transform handles fp16/bf16 natively (recent
+# releases do). Probed lazily on the first low-precision call; older releases fall
+# back to the fp32 round-trip.
+_had_low_precision_ok = None
+
+
+def hadamard_transform_anydtype(x, scale):
+    global _had_low_precision_ok
+    if x.dtype not in (torch.float16, torch.bfloat16):
+        return hadamard_transform(x, scale=scale)
+    if _had_low_precision_ok is None:
+        try:
+            hadamard_transform(x.reshape(-1, x.shape[-1])[:1].contiguous(), scale=scale)
+            _had_low_precision_ok = True
+        except (RuntimeError, NotImplementedError):
+            _had_low_precision_ok = False
+    if _had_low_precision_ok:
+        return hadamard_transform(x, scale=scale)
+    return hadamard_transform(x.float(), scale=scale).to(x.dtype)
 
 
 @torch.inference_mode
@@ -313,17 +505,25 @@ class QKRotationWrapper(torch.nn.Module):
     def forward(self, *args, **kwargs):
         q, k = self.func(*args, **kwargs)
         assert self.head_dim == q.shape[-1]
-        dtype = q.dtype
         if not self.disable_qk_rotation:
-            q = hadamard_transform(q.float(), scale=1 / math.sqrt(q.shape[-1])).to(dtype)
-            k = hadamard_transform(k.float(), scale=1 / math.sqrt(k.shape[-1])).to(dtype)
+            # Run the Hadamard transform in the activations' own fp16/bf16 dtype when the
+            # kernel supports it; this halves the bandwidth of a memory-bound per-token op.
+            q = hadamard_transform_anydtype(q, scale=1 / math.sqrt(q.shape[-1]))
+            k = hadamard_transform_anydtype(k, scale=1 / math.sqrt(k.shape[-1]))
 
         (bsz, num_heads, seq_len, head_dim) = k.shape
         if self.k_bits < 16:
             if self.k_groupsize == -1:  # token-wise quantization
-                token_wise_k = k.transpose(1, 2).reshape(-1, self.config.hidden_size)
-                self.k_quantizer.find_params(token_wise_k)
-                k = self.k_quantizer(token_wise_k).reshape((bsz, seq_len, num_heads, head_dim)).transpose(1, 2).to(q)
+                # Reduce over (heads, head_dim) in the natural layout; the old
+                # transpose(1, 2).reshape(-1, hidden_size) round-trip copied the full
+                # K tensor twice because the transpose breaks contiguity. Note this is
+                # a behavior change on GQA models: the old reshape used hidden_size,
+                # so it lumped several tokens under one scale on Mistral (and crashed
+                # on Qwen2, where bsz*seq*kv_dim is not divisible by hidden_size).
+                # This path is truly per-token, so Mistral K-cache numbers shift
+                # slightly vs. the published ones.
+                self.k_quantizer.find_params_reduce(k, dims=(1, 3))
+                k = self.k_quantizer(k).to(q)
             else:  # head-wise quantization
                 per_head_k = k.reshape(-1, head_dim)
                 self.k_quantizer.find_params(per_head_k)